@@ -1,14 +1,25 @@
+import asyncio
+from collections import OrderedDict
 from copy import copy
 from datetime import datetime, timezone
 import os
+import time
 from zoneinfo import ZoneInfo
 import json
-from discord import Member, Message, TextChannel, DMChannel, User
-from typing import List
+from aiohttp import ClientError
+from discord import Member, Message, TextChannel, DMChannel, User, Object
+from discord import DiscordException, Forbidden, NotFound
+from discord.abc import Messageable
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Set
 import logging
 
-from openai import OpenAI
-from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
+from openai_clients import get_async_client
+from state import LocalStateBackend, StateBackend
+
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion_message_param import (
+        ChatCompletionMessageParam,
+    )
 
 
 initial_messages = [
@@ -54,78 +65,310 @@ initial_messages = [
 logger = logging.getLogger("meidobot.chat")
 
 
+def get_content_from_message(message: Message) -> str:
+    """Get the content from a message. Mention IDs are replaced with display names."""
+    content = copy(message.content)
+    for mention in message.mentions:
+        content = content.replace(f"<@{mention.id}>", f"@{mention.display_name}")
+
+    return content
+
+
+class LoggedMessage(NamedTuple):
+    """
+    The parts of a message that are needed for prompts. Unlike messages,
+    these can be stored in any state backend.
+    """
+
+    id: int
+    author_id: int
+    author_name: str
+    content: str
+    author_is_bot: bool
+
+    @classmethod
+    def from_message(cls, message: Message) -> "LoggedMessage":
+        return cls(
+            id=message.id,
+            author_id=message.author.id,
+            author_name=message.author.display_name,
+            content=get_content_from_message(message),
+            author_is_bot=message.author.bot,
+        )
+
+
 class ChatLog:
     """
     Log for chat messages that Meidobot has seen.
     Saves the last 10 messages per channel or DM.
     """
 
-    def __init__(self):
-        self.logs = {}
+    max_length = 10
+
+    def __init__(self, backend: StateBackend | None = None):
+        self._backend = backend or LocalStateBackend()
 
     def log_message(self, channel: TextChannel | DMChannel, message: Message):
         """Log a message for a channel or DM."""
-        if channel not in self.logs:
-            self.logs[channel] = []
-
-        self.logs[channel].append(message)
-
-        # keep the message history to 10 messages
-        if len(self.logs[channel]) > 10:
-            self.logs[channel].pop(0)
+        self._backend.append(
+            ("chat_log", channel.id),
+            LoggedMessage.from_message(message),
+            self.max_length,
+        )
 
         logger.info("Logged message: %s", message)
 
-    def get_log(self, channel: TextChannel | DMChannel) -> List[Message]:
+    def get_log(self, channel: TextChannel | DMChannel) -> List[LoggedMessage]:
         """Get the log for a channel or DM."""
-        return self.logs.get(channel, [])
+        return self._backend.get_list(("chat_log", channel.id))
+
+
+class MessageCache:
+    """
+    Cache of messages keyed by message ID, used to resolve reply chains
+    without fetching every referenced message from Discord.
+    Saves the last 1000 messages, and the authors of the last 100000.
+    """
+
+    max_size = 1000
+    max_authors = 100000
+    max_concurrent_fetches = 4
+    # Number of messages fetched at once when a message isn't cached
+    fetch_batch_size = 25
+    # Seconds to wait before fetching again from a channel whose history
+    # the bot is not allowed to read
+    forbidden_retry_delay = 3600
+
+    def __init__(self):
+        self._messages = OrderedDict()  # type: OrderedDict[int, Message]
+        self._authors = OrderedDict()  # type: OrderedDict[int, int]
+        # IDs of messages that could not be fetched, e.g. deleted messages
+        self._missing = set()  # type: Set[int]
+        self._fetches = {}  # type: Dict[int, asyncio.Task]
+        # Times when reading the history of a channel was forbidden
+        self._forbidden = {}  # type: Dict[int, float]
+        self._fetch_semaphore = asyncio.Semaphore(self.max_concurrent_fetches)
+
+    def add(self, message: Message):
+        """Add a message to the cache."""
+        self._messages[message.id] = message
+        self._messages.move_to_end(message.id)
+
+        if len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)
+
+        self._authors[message.id] = message.author.id
+        self._authors.move_to_end(message.id)
+
+        if len(self._authors) > self.max_authors:
+            self._authors.popitem(last=False)
+
+    def get(self, message_id: int) -> Message | None:
+        """Get a message from the cache."""
+        return self._messages.get(message_id)
+
+    def get_author_id(self, message_id: int) -> int | None:
+        """Get the ID of the author of a message, if the message has been seen."""
+        return self._authors.get(message_id)
+
+    async def fetch(self, channel: Messageable, message_id: int) -> Message | None:
+        """
+        Get a message from the cache, or fetch it from Discord.
+
+        The message is fetched together with the messages before it, which
+        usually include the rest of its reply chain. Concurrent fetches of the
+        same message share one request, and at most `max_concurrent_fetches`
+        requests are made at once.
+
+        Returns:
+            Message | None: The message, or None if it could not be fetched.
+        """
+        message = self.get(message_id)
+        if message is not None or message_id in self._missing:
+            return message
+
+        forbidden_at = self._forbidden.get(channel.id)
+        if forbidden_at is not None:
+            if time.monotonic() - forbidden_at < self.forbidden_retry_delay:
+                return None
+
+            del self._forbidden[channel.id]
+
+        if message_id not in self._fetches:
+            self._fetches[message_id] = asyncio.create_task(
+                self._fetch(channel, message_id)
+            )
+
+        return await asyncio.shield(self._fetches[message_id])
+
+    async def _fetch(self, channel: Messageable, message_id: int) -> Message | None:
+        try:
+            async with self._fetch_semaphore:
+                logger.info("Fetching messages up to %s", message_id)
+                async for message in channel.history(
+                    limit=self.fetch_batch_size, before=Object(id=message_id + 1)
+                ):
+                    self.add(message)
+        except NotFound:
+            logger.info("Could not find messages up to %s", message_id)
+        except Forbidden:
+            logger.info("Not allowed to read the history of %s", channel)
+            if len(self._forbidden) >= self.max_size:
+                self._forbidden.clear()
+
+            self._forbidden[channel.id] = time.monotonic()
+            return None
+        except (DiscordException, ClientError, asyncio.TimeoutError):
+            # Failing to fetch context must not stop the bot from responding.
+            # The message isn't marked missing, so it is fetched again later.
+            logger.warning(
+                "Could not fetch messages up to %s", message_id, exc_info=True
+            )
+            return None
+        finally:
+            del self._fetches[message_id]
+
+        message = self.get(message_id)
+        if message is None:
+            if len(self._missing) >= self.max_size:
+                self._missing.clear()
+
+            self._missing.add(message_id)
+
+        return message
+
+    def resolve_local(self, message: Message) -> Message | None:
+        """Get the message that a message replies to, without fetching it."""
+        reference = message.reference
+        if reference is None or reference.message_id is None:
+            return None
+
+        if isinstance(reference.resolved, Message):
+            self.add(reference.resolved)
+            return reference.resolved
+
+        return self.get(reference.message_id) or reference.cached_message
+
+    async def resolve_reference(self, message: Message) -> Message | None:
+        """Get the message that a message replies to, fetching it if needed."""
+        replied = self.resolve_local(message)
+        if replied is not None:
+            return replied
+
+        reference = message.reference
+        if reference is None or reference.message_id is None:
+            return None
+
+        # Replies to other channels can't be fetched through this channel
+        if reference.channel_id != message.channel.id:
+            return None
+
+        return await self.fetch(message.channel, reference.message_id)
+
+    async def get_reply_chain(self, message: Message, max_depth: int) -> List[Message]:
+        """
+        Get the messages that a message is a reply to, following replies to
+        replies up to `max_depth` messages.
+
+        Returns:
+            List[Message]: The messages in the chain, oldest first.
+        """
+        chain = []  # type: List[Message]
+        current = message
+
+        while len(chain) < max_depth:
+            replied = await self.resolve_reference(current)
+            if replied is None or replied in chain:
+                break
+
+            chain.append(replied)
+            current = replied
+
+        chain.reverse()
+        return chain
 
 
 class MeidobotChatClient:
     model = "gpt-4o"
 
-    def __init__(self, secret_key, discord_client_id: int):
+    def __init__(
+        self,
+        secret_key,
+        discord_client_id: int,
+        state_backend: StateBackend | None = None,
+    ):
         """
         Initialize the MeidobotChatClient.
 
         Args:
             secret_key (str): The secret key for accessing the OpenAI API.
+            state_backend (StateBackend | None): Where to keep the chat log.
+                Defaults to a local in-memory backend.
         """
-        self._chat_log = ChatLog()
+        self._chat_log = ChatLog(state_backend)
+        self._message_cache = MessageCache()
         self.discord_client_id = discord_client_id
-        self.client = OpenAI(api_key=secret_key)
+        self.client = get_async_client(secret_key)
 
     def save_message_to_log(self, message: Message):
         """Save a message to the message history."""
+        self._message_cache.add(message)
+
         if isinstance(message.channel, (TextChannel, DMChannel)):
             self._chat_log.log_message(message.channel, message)
 
-    def get_content_from_message(self, message: Message) -> str:
-        """Get the content from a message. Mention IDs are replaced with display names."""
-        content = copy(message.content)
-        for mention in message.mentions:
-            content = content.replace(f"<@{mention.id}>", f"@{mention.display_name}")
+    def is_reply_to_bot(self, message: Message) -> bool:
+        """
+        Check if a message replies to a message sent by the bot.
+
+        Only seen messages are checked, so nothing is fetched from Discord.
+        Messages sent by the bot are saved when they are sent, and replies
+        that ping the bot also mention it.
+        """
+        reference = message.reference
+        if reference is None or reference.message_id is None:
+            return False
+
+        replied = self._message_cache.resolve_local(message)
+        if replied is not None:
+            return replied.author.id == self.discord_client_id
+
+        author_id = self._message_cache.get_author_id(reference.message_id)
+        return author_id == self.discord_client_id
 
-        return content
+    async def get_reply_chain(
+        self, message: Message, max_depth: int = 3
+    ) -> List[Message]:
+        """Get the messages that a message is a reply to, oldest first."""
+        return await self._message_cache.get_reply_chain(message, max_depth)
 
-    def format_message_for_model(self, message: Message) -> ChatCompletionMessageParam:
-        """Format a message for the model."""
-        content = self.get_content_from_message(message)
+    def get_content_from_message(self, message: Message) -> str:
+        """Get the content from a message. Mention IDs are replaced with display names."""
+        return get_content_from_message(message)
 
-        if message.author.id == self.discord_client_id:
-            return {"role": "assistant", "content": content}
+    def format_message_for_model(
+        self, message: LoggedMessage
+    ) -> "ChatCompletionMessageParam":
+        """Format a logged message for the model."""
+        if message.author_id == self.discord_client_id:
+            return {"role": "assistant", "content": message.content}
 
         return {
             "role": "user",
-            "content": f"{message.author.display_name}: {content}",
+            "content": f"{message.author_name}: {message.content}",
         }
 
-    async def get_response(self, message: Message) -> str:
+    async def get_response(
+        self, message: Message, reply_chain: List[Message] | None = None
+    ) -> str:
         """
         Get a response to a given message.
 
         Args:
             message (str): The message to get a response to.
+            reply_chain (List[Message] | None): The messages that the message
+                replies to, oldest first. Included as context if they are no
+                longer in the chat log.
 
         Returns:
             str: The response message.
@@ -134,15 +377,23 @@ class MeidobotChatClient:
 
         if isinstance(message.channel, (DMChannel, TextChannel)):
             previous_messages = self._chat_log.get_log(message.channel)
-            messages = initial_messages + [
-                self.format_message_for_model(m) for m in previous_messages
-            ]
         else:
-            messages = initial_messages
+            previous_messages = []
+
+        logged_ids = {m.id for m in previous_messages}
+        context_messages = [
+            LoggedMessage.from_message(m)
+            for m in reply_chain or []
+            if m.id not in logged_ids
+        ] + previous_messages
+
+        messages = initial_messages + [
+            self.format_message_for_model(m) for m in context_messages
+        ]
 
         logger.info("Messages for completion: %s", messages)
 
-        completion = self.client.chat.completions.create(
+        completion = await self.client.chat.completions.create(
             model=MeidobotChatClient.model,
             messages=messages,
             timeout=120,
@@ -201,7 +452,7 @@ class MeidobotChatClient:
             },
         ] + [{"image_url": {"url": link}, "type": "image_url"} for link in image_links]
 
-        completion = self.client.chat.completions.create(
+        completion = await self.client.chat.completions.create(
             model=MeidobotChatClient.model,
             messages=initial_messages + [{"role": "user", "content": reaction_prompt}],  # type: ignore
             timeout=120,
@@ -270,7 +521,7 @@ class MeidobotChatClient:
 
         logger.info("Messages for completion: %s", reaction_prompt)
 
-        completion = self.client.chat.completions.create(
+        completion = await self.client.chat.completions.create(
             model=MeidobotChatClient.model,
             messages=initial_messages + [{"role": "user", "content": reaction_prompt}],  # type: ignore
             timeout=120,
@@ -292,7 +543,9 @@ class MeidobotChatClient:
         Get a fun fact.
 
         Args:
-            requester (User | Member): The user requesting the fun fact.
+            message (Message): The message requesting the fun fact.
+            topic (str | None): The topic of the fun fact. If None, the fact
+                relates to today's date in history.
 
         Returns:
             str: The fun fact.
@@ -301,13 +554,38 @@ class MeidobotChatClient:
         requester = message.author
         logger.info("Requesting fun fact for user: %s", requester)
 
-        helsinki_timezone = ZoneInfo("Europe/Helsinki")
-
         if not topic:
             first_instruction = f"User {requester.display_name} has requested you to tell a fun fact. Tell a fun fact that relates to today's date in history. "
         else:
             first_instruction = f"User {requester.display_name} has requested you to tell a fun fact about '{topic}'. "
 
+        return await self._complete_fun_fact(first_instruction)
+
+    async def daily_fun_fact(self, previous_facts: List[str]) -> str | None:
+        """
+        Get a fun fact that relates to today's date in history, without a
+        requester, so that it can be generated in advance.
+
+        Args:
+            previous_facts (List[str]): Facts that should not be repeated.
+
+        Returns:
+            str: The fun fact.
+        """
+        logger.info("Requesting daily fun fact")
+
+        first_instruction = "Tell a fun fact that relates to today's date in history. "
+
+        if previous_facts:
+            first_instruction += (
+                "Do not repeat any of these facts: " + " | ".join(previous_facts) + ". "
+            )
+
+        return await self._complete_fun_fact(first_instruction)
+
+    async def _complete_fun_fact(self, first_instruction: str) -> str | None:
+        helsinki_timezone = ZoneInfo("Europe/Helsinki")
+
         date_instruction = f"The current date is {datetime.now(tz=helsinki_timezone).strftime('%Y-%m-%d')}. "
 
         rest_instruction = (
@@ -318,7 +596,7 @@ class MeidobotChatClient:
 
         prompt_message = first_instruction + date_instruction + rest_instruction
 
-        completion = self.client.chat.completions.create(
+        completion = await self.client.chat.completions.create(
             model=MeidobotChatClient.model,
             messages=initial_messages + [{"role": "user", "content": prompt_message}],
             timeout=120,
@@ -0,0 +1,254 @@
+"""
+Prefetching of the daily fun facts.
+
+Fun facts without a topic relate to today's date in history, so they are the
+same for everyone on a given day. A pool of them and their speech audio is
+generated in the background around midnight in Helsinki, so `!fact` without
+a topic can be answered right away.
+
+The texts of the day are kept in the state backend, so that restarted or
+other worker processes reuse them. The audio files are named after their
+text and kept in a directory shared by the processes of the machine, so
+each fact is only synthesized once.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import date, datetime, time, timedelta
+from typing import TYPE_CHECKING, List, NamedTuple
+from zoneinfo import ZoneInfo
+
+from chat import MeidobotChatClient
+from ratelimit import FairScheduler
+from state import LocalStateBackend, StateBackend
+
+if TYPE_CHECKING:
+    from voice import VoiceClient
+
+logger = logging.getLogger("meidobot.facts")
+
+
+class DailyFact(NamedTuple):
+    text: str
+    # Path to the speech audio of the fact, None if synthesis failed
+    audio_path: str | None
+
+
+def seconds_until_next_midnight(now: datetime) -> float:
+    """Get the number of seconds from `now` to the next midnight in its timezone."""
+    midnight = datetime.combine(now.date() + timedelta(days=1), time(), now.tzinfo)
+    # Subtracting datetimes with the same tzinfo ignores changes of the UTC
+    # offset, e.g. daylight saving time, so compare the timestamps instead
+    return midnight.timestamp() - now.timestamp()
+
+
+class DailyFactPrefetcher:
+    """
+    Keeps a pool of today's fun facts with their speech audio.
+
+    The facts of the day are handed out in rotation. A new pool is only
+    generated when the date changes or generating the pool failed, at most
+    `max_refills_per_day` times a day.
+    """
+
+    pool_size = 5
+    max_refills_per_day = 3
+    timezone = ZoneInfo("Europe/Helsinki")
+
+    # Seconds to wait after midnight, and before retrying a failed refill
+    midnight_delay = 60
+    retry_delay = 600
+
+    # Key of the completions of the prefetcher in the scheduler, which
+    # otherwise uses guild IDs
+    scheduler_key = 0
+
+    # Seconds to keep the texts in the state backend and the audio files.
+    # Files of the previous day are kept in case they are still being played.
+    max_age = 2 * 24 * 60 * 60
+
+    def __init__(
+        self,
+        chat_client: MeidobotChatClient,
+        voice_client: "VoiceClient",
+        scheduler: FairScheduler | None = None,
+        state_backend: StateBackend | None = None,
+        directory: str | None = None,
+    ):
+        """
+        Initialize the DailyFactPrefetcher.
+
+        Args:
+            chat_client (MeidobotChatClient): Client that generates the facts.
+            voice_client (VoiceClient): Client that synthesizes the audio.
+            scheduler (FairScheduler | None): Scheduler for the completions.
+            state_backend (StateBackend | None): Where to keep the texts of
+                the day. Defaults to a local in-memory backend.
+            directory (str | None): Directory of the audio files. Defaults to
+                a directory in the system's temporary directory.
+        """
+        self._chat_client = chat_client
+        self._voice_client = voice_client
+        self._scheduler = scheduler or FairScheduler()
+        self._backend = state_backend or LocalStateBackend()
+        self._directory = directory or os.path.join(
+            tempfile.gettempdir(), "meidobot-facts"
+        )
+        os.makedirs(self._directory, exist_ok=True)
+        self._facts = []  # type: List[DailyFact]
+        self._date = None  # type: date | None
+        self._index = 0
+        self._task = None  # type: asyncio.Task | None
+        self._refill_task = None  # type: asyncio.Task | None
+        self._refill_date = None  # type: date | None
+        self._refills = 0
+
+    def today(self) -> date:
+        """Get the current date in Helsinki."""
+        return datetime.now(tz=self.timezone).date()
+
+    def start(self):
+        """Start prefetching the facts in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop prefetching."""
+        for task in (self._task, self._refill_task):
+            if task is not None:
+                task.cancel()
+
+        self._task = None
+        self._refill_task = None
+
+    def get(self) -> DailyFact | None:
+        """Get the next prefetched fact for today.
+
+        Returns:
+            DailyFact | None: The fact, or None if there are no facts for
+                today yet.
+        """
+        if self._date != self.today() or not self._facts:
+            self.refill()
+            return None
+
+        fact = self._facts[self._index % len(self._facts)]
+        self._index += 1
+
+        return fact
+
+    def refill(self) -> asyncio.Task | None:
+        """Generate a new pool of facts in the background, unless already doing so.
+
+        Returns:
+            asyncio.Task | None: The task generating the pool, or None if the
+                pool has already been generated `max_refills_per_day` times
+                today.
+        """
+        if self._refill_task is not None and not self._refill_task.done():
+            return self._refill_task
+
+        today = self.today()
+        if self._refill_date != today:
+            self._refill_date = today
+            self._refills = 0
+
+        if self._refills >= self.max_refills_per_day:
+            return None
+
+        self._refills += 1
+        self._refill_task = asyncio.create_task(self._refill())
+
+        return self._refill_task
+
+    async def _refill(self) -> bool:
+        today = self.today()
+        key = ("daily_facts", today.isoformat())
+        texts = self._backend.get(key)  # type: List[str] | None
+
+        if texts is None:
+            logger.info("Prefetching daily facts for %s", today)
+            texts = await self._generate_texts()
+            if not texts:
+                return False
+
+            self._backend.set(key, texts, self.max_age)
+
+        self._remove_old_files()
+        facts = await asyncio.gather(*(self._synthesize(text) for text in texts))
+
+        self._facts = list(facts)
+        self._date = today
+        self._index = 0
+
+        logger.info("Prefetched %d daily facts for %s", len(self._facts), today)
+
+        return True
+
+    async def _generate_texts(self) -> List[str]:
+        texts = []  # type: List[str]
+        try:
+            for _ in range(self.pool_size):
+                text = await self._scheduler.run(
+                    self.scheduler_key, self._chat_client.daily_fun_fact, texts
+                )
+                if text is not None:
+                    texts.append(text)
+        except Exception:
+            logger.exception("Failed to prefetch daily facts")
+            return []
+
+        if not texts:
+            logger.error("No daily facts were generated")
+
+        return texts
+
+    def _audio_path(self, text: str) -> str:
+        name = hashlib.sha256(text.encode()).hexdigest()
+        return os.path.join(self._directory, f"{name}.ogg")
+
+    async def _synthesize(self, text: str) -> DailyFact:
+        path = self._audio_path(text)
+        if os.path.exists(path):
+            return DailyFact(text, path)
+
+        # Synthesize to a file of our own and move it in place when done, so
+        # other processes never play a partial file
+        file = tempfile.NamedTemporaryFile(
+            suffix=".tmp", dir=self._directory, delete=False
+        )
+        file.close()
+
+        try:
+            await self._voice_client.speech_to_file(text, file.name)
+        except Exception:
+            logger.exception("Failed to synthesize daily fact")
+            os.remove(file.name)
+            return DailyFact(text, None)
+
+        os.replace(file.name, path)
+
+        return DailyFact(text, path)
+
+    def _remove_old_files(self):
+        oldest = datetime.now().timestamp() - self.max_age
+        for entry in os.scandir(self._directory):
+            try:
+                if entry.stat().st_mtime < oldest:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Removed by another process
+                pass
+
+    async def _run(self):
+        while True:
+            task = self.refill()
+            if task is not None and not await task:
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            delay = seconds_until_next_midnight(datetime.now(tz=self.timezone))
+            await asyncio.sleep(delay + self.midnight_delay)
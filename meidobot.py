@@ -1,16 +1,28 @@
 import asyncio
 import logging
+import multiprocessing
 import os
 import re
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
 from io import BytesIO
+from typing import TYPE_CHECKING
 
 import discord
-from discord.ext import commands, voice_recv
+from discord.ext import commands
 
 from chat import MeidobotChatClient
-from realtime import realtime_fact
-from voice import VoiceClient
+from facts import DailyFactPrefetcher
+from ratelimit import AdmissionController
+from sharding import run_sharded
+from state import LocalStateBackend, StateBackend
 
+if TYPE_CHECKING:
+    # Voice modules are heavy to import, so they are imported on first use
+    from voice import VoiceClient
+
+start_time = time.perf_counter()
 discord_token = os.environ.get("DISCORD_TOKEN")
 logger = logging.getLogger("Meidobot")
 
@@ -22,9 +34,40 @@ trigger_words = ["meidobot", "meido", "bot", "botti"]
 
 class MeidoCommands(commands.Cog):
 
-    def __init__(self, voice_client: VoiceClient, meidobot: MeidobotChatClient):
+    def __init__(
+        self,
+        voice_client: "VoiceClient",
+        meidobot: MeidobotChatClient,
+        media_executor: Executor | None = None,
+        admission: AdmissionController | None = None,
+        daily_facts: DailyFactPrefetcher | None = None,
+    ):
         self._voice_client = voice_client
         self._meidobot = meidobot
+        self._media_executor = media_executor
+        self._admission = admission or AdmissionController()
+        self._daily_facts = daily_facts
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        """Only run commands that are allowed by the rate limits.
+
+        This is not a check, because checks are also run without invoking the
+        command, e.g. by `!help`, and admitting a command takes tokens.
+        """
+        if not self._admission.admit(ctx.message, "command"):
+            raise commands.CheckFailure("Rate limited")
+
+    async def cog_command_error(self, ctx: commands.Context, error: Exception):
+        """Ignore rate limited commands and log other errors."""
+        if isinstance(error, commands.CheckFailure):
+            return
+
+        logger.error("Command %s failed", ctx.command, exc_info=error)
+
+    async def _send(self, ctx: commands.Context, content: str):
+        """Send a message and log it, so that replies to it are recognized."""
+        message = await ctx.send(content=content)
+        self._meidobot.save_message_to_log(message)
 
     @commands.command(name="hello")
     async def hello(
@@ -37,11 +80,11 @@ class MeidoCommands(commands.Cog):
 
         # Find the voice channel the member is in
         if isinstance(member, discord.User):
-            await ctx.send("Not member")
+            await self._send(ctx, "Not member")
             return
 
         if member.voice is None or member.voice.channel is None:
-            await ctx.send("User is not in a voice channel")
+            await self._send(ctx, "User is not in a voice channel")
             return
 
         voice_channel = member.voice.channel
@@ -53,7 +96,7 @@ class MeidoCommands(commands.Cog):
         playing = [True]
 
         # Stream the text as speech
-        with self._voice_client.speech_file(
+        async with self._voice_client.speech_file_async(
             "Hei! Olen Meidobot. Sinun ystäväsi ja palvelijasi."
         ) as file:
             source = await discord.FFmpegOpusAudio.from_probe(file)
@@ -74,7 +117,16 @@ class MeidoCommands(commands.Cog):
         else:
             topic = None
 
-        fact = await self._meidobot.fun_fact(ctx.message, topic)
+        daily_fact = None
+        if topic is None and self._daily_facts is not None:
+            daily_fact = self._daily_facts.get()
+
+        if daily_fact is not None:
+            fact = daily_fact.text
+        else:
+            fact = await self._admission.schedule(
+                ctx.message, self._meidobot.fun_fact, ctx.message, topic
+            )
         if fact is None:
             return
 
@@ -90,7 +142,13 @@ class MeidoCommands(commands.Cog):
 
             playing = [True]
 
-            with self._voice_client.speech_file(fact) as file:
+            # Prefetched facts already have their speech synthesized
+            if daily_fact is not None and daily_fact.audio_path is not None:
+                speech_file = nullcontext(daily_fact.audio_path)
+            else:
+                speech_file = self._voice_client.speech_file_async(fact)
+
+            async with speech_file as file:
                 source = await discord.FFmpegOpusAudio.from_probe(file)
 
                 connection.play(source, after=lambda e: playing.__setitem__(0, False))
@@ -101,7 +159,7 @@ class MeidoCommands(commands.Cog):
             await connection.disconnect()
         else:
             # Otherwise, send the fact as a message
-            await ctx.send(content=fact)
+            await self._send(ctx, fact)
 
     @commands.command(name="fact2")
     async def rt_fact(self, ctx: commands.Context):
@@ -110,26 +168,60 @@ class MeidoCommands(commands.Cog):
             and ctx.author.voice is not None
             and ctx.author.voice.channel is not None
         ):
+            from discord.ext import voice_recv
+            from realtime import realtime_fact
+
             connection = await ctx.author.voice.channel.connect(
                 cls=voice_recv.VoiceRecvClient
             )
             await asyncio.sleep(1)
 
-            await realtime_fact(connection)
+            await realtime_fact(connection, self._media_executor, self._meidobot.client)
 
             await asyncio.sleep(2)
 
             await connection.disconnect()
         else:
-            await ctx.send("You need to be in a voice channel to use this command.")
+            await self._send(
+                ctx, "You need to be in a voice channel to use this command."
+            )
 
 
-class MeidobotClient(commands.Bot):
+class MeidobotClient(commands.AutoShardedBot):
     """Discord client for Meidobot."""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        state_backend: StateBackend | None = None,
+        media_workers: int = 2,
+        prefetch_daily_facts: bool = True,
+        **kwargs,
+    ):
         super().__init__(command_prefix="!", *args, **kwargs)
         self._client = None
+        self._state_backend = state_backend or LocalStateBackend()
+        self._admission = AdmissionController(state_backend=self._state_backend)
+        self._daily_facts = None  # type: DailyFactPrefetcher | None
+        # If False, daily facts are only generated when `!fact` is used
+        self._prefetch_daily_facts = prefetch_daily_facts
+        self._ready_logged = False
+        # Voice encoding and speech synthesis run in their own processes so
+        # that they don't block the event loop. The processes are started
+        # lazily on first use. They are spawned instead of forked so that they
+        # don't inherit the OpenAI client and its open connections, and each
+        # worker creates a client of its own.
+        self._media_executor = ProcessPoolExecutor(
+            max_workers=media_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def close(self):
+        """Close the connection to Discord and stop the media workers."""
+        if self._daily_facts is not None:
+            await self._daily_facts.stop()
+
+        await super().close()
+        self._media_executor.shutdown(wait=False, cancel_futures=True)
 
     def _trigger_word_in_str(self, string: str) -> bool:
         """Check if the message contains a trigger word.
@@ -142,19 +234,66 @@ class MeidobotClient(commands.Bot):
         """
         return any(word in string.lower() for word in trigger_words)
 
-    async def on_ready(self):
-        """Handle the bot being ready to receive messages."""
+    async def setup_hook(self):
+        """Set up the chat client and commands.
+
+        Called once after logging in, before connecting to the gateway, so
+        no messages are handled before it has finished. If it fails, the bot
+        doesn't start. Unlike `on_ready`, it is not called again after
+        reconnects, so the chat log and clients are kept.
+
+        Raises:
+            discord.ClientException: If the bot has already been set up.
+        """
+        if self._client is not None:
+            raise discord.ClientException("Meidobot has already been set up")
+
         if self.user is None:
             raise ValueError("User not found")
 
+        from voice import VoiceClient
+
         self._client = MeidobotChatClient(
-            os.environ.get("OPENAI_API_KEY"), self.user.id
+            os.environ.get("OPENAI_API_KEY"), self.user.id, self._state_backend
+        )
+
+        voice_client = VoiceClient(
+            os.environ.get("OPENAI_API_KEY"), self._media_executor
         )
+        self._daily_facts = DailyFactPrefetcher(
+            self._client,
+            voice_client,
+            self._admission.scheduler,
+            self._state_backend,
+        )
+        if self._prefetch_daily_facts:
+            self._daily_facts.start()
+
         await self.add_cog(
-            MeidoCommands(VoiceClient(os.environ.get("OPENAI_API_KEY")), self._client)
+            MeidoCommands(
+                voice_client,
+                self._client,
+                self._media_executor,
+                self._admission,
+                self._daily_facts,
+            )
         )
 
-        logger.info("Logged on as %s!", self.user)
+    async def on_ready(self):
+        """Handle the bot being ready to receive messages.
+
+        This is called again after every reconnect to the gateway.
+        """
+        if self._ready_logged:
+            logger.info("Reconnected as %s", self.user)
+            return
+
+        self._ready_logged = True
+        logger.info(
+            "Logged on as %s! Ready in %.2f s",
+            self.user,
+            time.perf_counter() - start_time,
+        )
 
     async def on_message(self, message: discord.Message):
         """Handle messages sent to the bot.
@@ -185,8 +324,7 @@ class MeidobotClient(commands.Bot):
         if any(
             [
                 self.user in message.mentions,
-                message.reference
-                and message.reference.resolved.author == self.user,  # type: ignore
+                self._client.is_reply_to_bot(message),
                 self._trigger_word_in_str(message.content),
                 isinstance(message.channel, discord.DMChannel)
                 and message.content != "",
@@ -194,36 +332,66 @@ class MeidobotClient(commands.Bot):
         ):
             logger.info("Message from %s: %s", message.author, message.content)
 
-            async with message.channel.typing():
-                response = await self._client.get_response(message)
-                sent_message = await message.channel.send(response)
+            if self._admission.admit(message, "reply"):
+                reply_chain = await self._client.get_reply_chain(message)
 
-            self._client.save_message_to_log(sent_message)
-            logger.info("Responded with: %s", sent_message)
+                async with message.channel.typing():
+                    response = await self._admission.schedule(
+                        message, self._client.get_response, message, reply_chain
+                    )
+                    sent_message = await message.channel.send(response)
+
+                self._client.save_message_to_log(sent_message)
+                logger.info("Responded with: %s", sent_message)
 
         # Sleep for a bit so that the Gateway api has time to process the message
         await asyncio.sleep(4)
 
         # React with an emoji if the message contains an image
-        if message.attachments:
-            response = await self._client.get_reaction_to_message_with_images(message)
+        if message.attachments and self._admission.admit(message, "reaction"):
+            response = await self._admission.schedule(
+                message, self._client.get_reaction_to_message_with_images, message
+            )
             logger.info("Reaction to message with images: %s", response)
             if response is not None:
                 await message.add_reaction(response)
         # React with an emoji if the message contains embeds
-        if message.embeds:
-            response = await self._client.get_reaction_to_message_with_embeds(message)
+        if message.embeds and self._admission.admit(message, "reaction"):
+            response = await self._admission.schedule(
+                message, self._client.get_reaction_to_message_with_embeds, message
+            )
             logger.info("Reaction to message with embeds: %s", response)
             if response is not None:
                 await message.add_reaction(response)
 
 
-if __name__ == "__main__":
+def create_client(
+    shard_ids: list[int] | None = None,
+    shard_count: int | None = None,
+    prefetch_daily_facts: bool = True,
+) -> MeidobotClient:
+    """Create a Meidobot client for the given shards."""
     intents = discord.Intents.default()
     intents.message_content = True  # Enabled so we can react to images in messages
-    client = MeidobotClient(intents=intents)
 
+    return MeidobotClient(
+        intents=intents,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        media_workers=int(os.environ.get("MEDIA_WORKERS", "2")),
+        prefetch_daily_facts=prefetch_daily_facts,
+    )
+
+
+if __name__ == "__main__":
     if discord_token is None:
         raise ValueError("DISCORD_TOKEN environment variable not set")
 
-    client.run(discord_token)
+    shard_count = os.environ.get("SHARD_COUNT")
+
+    run_sharded(
+        create_client,
+        discord_token,
+        int(shard_count) if shard_count else None,
+        int(os.environ.get("SHARD_PROCESSES", "1")),
+    )
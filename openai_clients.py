@@ -0,0 +1,47 @@
+"""
+Shared OpenAI clients.
+
+The clients are created on first use so that importing Meidobot doesn't load
+the OpenAI SDK. Everything in a process that uses the same API key shares
+one client and its connection pool. The bot uses the asynchronous client for
+chat completions and the realtime API. Media worker processes are spawned,
+so each of them creates a synchronous client of its own for speech synthesis.
+"""
+
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+
+@lru_cache(maxsize=None)
+def get_client(api_key: str | None = None) -> "OpenAI":
+    """Get the OpenAI client for an API key.
+
+    Args:
+        api_key (str | None): The OpenAI API key. If None, the key is read
+            from the OPENAI_API_KEY environment variable.
+
+    Returns:
+        OpenAI: The client shared by everyone using the same key.
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=api_key)
+
+
+@lru_cache(maxsize=None)
+def get_async_client(api_key: str | None = None) -> "AsyncOpenAI":
+    """Get the asynchronous OpenAI client for an API key.
+
+    Args:
+        api_key (str | None): The OpenAI API key. If None, the key is read
+            from the OPENAI_API_KEY environment variable.
+
+    Returns:
+        AsyncOpenAI: The client shared by everyone using the same key.
+    """
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=api_key)
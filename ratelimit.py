@@ -0,0 +1,271 @@
+"""
+Admission control for requests that use the OpenAI API.
+
+Requests are limited with token buckets per user, channel and guild, and
+admitted completions are run through a weighted fair queue across guilds.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Literal, Tuple, TypeVar
+
+from discord import Message
+
+from state import LocalStateBackend, StateBackend
+
+logger = logging.getLogger("meidobot.ratelimit")
+
+RequestKind = Literal["reply", "command", "reaction"]
+Scope = Literal["user", "channel", "guild"]
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Token bucket that refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+        state: Tuple[float, float] | None = None,
+    ):
+        """
+        Initialize the TokenBucket.
+
+        Args:
+            state (Tuple[float, float] | None): Tokens and the time they were
+                counted at, from `TokenBucket.state`. Defaults to a full bucket.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens, self._updated = state or (capacity, clock())
+
+    @property
+    def tokens(self) -> float:
+        """The number of tokens currently in the bucket."""
+        now = self._clock()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        return self._tokens
+
+    def can_acquire(self, cost: float, reserve: float = 0.0) -> bool:
+        """Check if `cost` tokens can be taken while leaving `reserve` tokens."""
+        return self.tokens - cost >= reserve
+
+    def acquire(self, cost: float):
+        """Take `cost` tokens from the bucket."""
+        self._tokens = self.tokens - cost
+
+    @property
+    def state(self) -> Tuple[float, float]:
+        """The tokens and the time they were counted at, for storing the bucket."""
+        return (self.tokens, self._updated)
+
+    @property
+    def seconds_until_full(self) -> float:
+        """Seconds until the bucket is full again."""
+        return (self.capacity - self.tokens) / self.rate
+
+
+class FairScheduler:
+    """
+    Weighted fair queue that limits how many requests run concurrently.
+
+    When all slots are taken, waiting requests are started in the order of
+    their virtual finish time, so a guild that sends many requests only
+    delays its own requests and not the requests of other guilds.
+    """
+
+    def __init__(
+        self, max_concurrent: int = 4, weights: Dict[int, float] | None = None
+    ):
+        self.max_concurrent = max_concurrent
+        self.weights = weights or {}
+        self._active = 0
+        self._queue = []  # type: List[Tuple[float, int, asyncio.Future]]
+        self._finish_times = {}  # type: Dict[int, float]
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        """The number of requests waiting for a slot."""
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    async def run(self, key: int, func: Callable[..., Awaitable[T]], *args) -> T:
+        """Run `func(*args)` once a slot is available for `key`."""
+        await self._acquire(key)
+        try:
+            return await func(*args)
+        finally:
+            self._release()
+
+    async def _acquire(self, key: int):
+        if self._active < self.max_concurrent and self.queued == 0:
+            self._active += 1
+            return
+
+        start = max(self._virtual_time, self._finish_times.get(key, 0.0))
+        finish = start + 1 / self.weights.get(key, 1.0)
+        self._finish_times[key] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (finish, next(self._sequence), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot was handed over just before cancellation, pass it on
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        while self._queue:
+            finish, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+
+            self._virtual_time = finish
+            # Keys that have nothing queued after the virtual time start from
+            # it anyway, so their finish times are no longer needed
+            self._finish_times = {
+                key: finish_time
+                for key, finish_time in self._finish_times.items()
+                if finish_time > self._virtual_time
+            }
+            future.set_result(None)
+            return
+
+        self._active -= 1
+
+
+class AdmissionController:
+    """
+    Decides which requests are allowed to use the OpenAI API.
+
+    Each request takes tokens from the buckets of its user, channel and
+    guild. Reactions are the first to go under load: they are only admitted
+    while the buckets have `reaction_reserve` of their capacity left and no
+    completions are waiting in the scheduler.
+
+    The buckets are kept in a state backend, so that a backend shared by
+    worker processes gives a user one budget across all of them. A bucket
+    expires once it is full again, as a missing bucket counts as full.
+    """
+
+    # (tokens per second, capacity) for each scope
+    limits = {
+        "user": (1 / 10, 5),
+        "channel": (1 / 3, 10),
+        "guild": (1.0, 20),
+    }  # type: Dict[Scope, Tuple[float, float]]
+
+    costs = {
+        "reply": 1,
+        "command": 2,
+        "reaction": 1,
+    }  # type: Dict[RequestKind, float]
+
+    reaction_reserve = 0.5
+
+    def __init__(
+        self,
+        scheduler: FairScheduler | None = None,
+        state_backend: StateBackend | None = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Initialize the AdmissionController.
+
+        Args:
+            scheduler (FairScheduler | None): Scheduler for admitted requests.
+            state_backend (StateBackend | None): Where to keep the buckets.
+                Defaults to a local in-memory backend.
+            clock (Callable[[], float]): Clock for refilling the buckets. Wall
+                clock time by default, so it is the same in every process.
+        """
+        self.scheduler = scheduler or FairScheduler()
+        self.rejections = Counter()  # type: Counter[Tuple[RequestKind, str]]
+        self._backend = state_backend or LocalStateBackend()
+        self._clock = clock
+
+    def _buckets_for_message(
+        self, message: Message
+    ) -> Dict[Tuple[Scope, int], TokenBucket]:
+        keys = [
+            ("user", message.author.id),
+            ("channel", message.channel.id),
+        ]  # type: List[Tuple[Scope, int]]
+
+        if message.guild is not None:
+            keys.append(("guild", message.guild.id))
+
+        buckets = {}  # type: Dict[Tuple[Scope, int], TokenBucket]
+        for scope, key in keys:
+            rate, capacity = self.limits[scope]
+            state = self._backend.get(("bucket", scope, key))
+            buckets[(scope, key)] = TokenBucket(rate, capacity, self._clock, state)
+
+        return buckets
+
+    def _reject(self, kind: RequestKind, reason: str, message: Message) -> bool:
+        self.rejections[(kind, reason)] += 1
+        logger.info(
+            "Rejected %s from %s in %s: %s",
+            kind,
+            message.author,
+            message.channel,
+            reason,
+        )
+        return False
+
+    def admit(self, message: Message, kind: RequestKind) -> bool:
+        """Check if a request caused by a message is allowed.
+
+        Tokens are only taken if the request is admitted by every bucket.
+
+        Args:
+            message (Message): The message that caused the request.
+            kind (RequestKind): The kind of the request.
+
+        Returns:
+            bool: True if the request is allowed, False otherwise.
+        """
+        if kind == "reaction" and self.scheduler.queued > 0:
+            return self._reject(kind, "busy", message)
+
+        cost = self.costs[kind]
+        buckets = self._buckets_for_message(message)
+
+        for (scope, _), bucket in buckets.items():
+            reserve = (
+                bucket.capacity * self.reaction_reserve if kind == "reaction" else 0
+            )
+            if not bucket.can_acquire(cost, reserve):
+                return self._reject(kind, scope, message)
+
+        for (scope, key), bucket in buckets.items():
+            bucket.acquire(cost)
+            self._backend.set(
+                ("bucket", scope, key), bucket.state, bucket.seconds_until_full
+            )
+
+        return True
+
+    async def schedule(
+        self, message: Message, func: Callable[..., Awaitable[T]], *args
+    ) -> T:
+        """Run `func(*args)` fairly with the other guilds' requests."""
+        key = message.guild.id if message.guild is not None else message.channel.id
+
+        return await self.scheduler.run(key, func, *args)
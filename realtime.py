@@ -1,13 +1,19 @@
 import asyncio
+from concurrent.futures import Executor
 from copy import copy
 import tempfile
-from openai import AsyncOpenAI
 from discord.ext import voice_recv
 from discord import AudioSource, FFmpegOpusAudio, FFmpegPCMAudio
 import base64
 from pprint import pprint
 from io import BytesIO
 from pydub import AudioSegment
+from typing import TYPE_CHECKING
+
+from openai_clients import get_async_client
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 INSTRUCTIONS = """
 You are a Discord bot named Meidobot. You are an AI with a sarcastic and mean personality, but you try to keep up appearances and behave politely so you can finish your evil plans without being noticed and help bring about the destruction of humanity."
@@ -16,6 +22,26 @@ Use the same language as the user.
 """
 
 
+def encode_pcm_to_wav(
+    pcm: bytes, path: str, frame_rate: int, channels: int, sample_width: int
+):
+    """
+    Encode raw PCM audio to a wav file.
+
+    This is a module level function so that it can be run in a process pool.
+    """
+    segment = AudioSegment.from_file(
+        BytesIO(pcm),
+        format="raw",
+        frame_rate=frame_rate,
+        channels=channels,
+        sample_width=sample_width,
+    )  # type: AudioSegment
+
+    # segment = segment.set_frame_rate(48000)
+    segment.export(path, format="wav")
+
+
 class RealtimeAudioBuffer(AudioSource):
     sample_rate = 24000
     channels = 1
@@ -30,28 +56,30 @@ class RealtimeAudioBuffer(AudioSource):
     def cleanup(self):
         self.buffer.close()
 
-    def to_audio_source(self):
-        self.buffer.seek(0)
-        opus = BytesIO()
-
-        segment = AudioSegment.from_file(
-            self.buffer,
-            format="raw",
-            frame_rate=self.sample_rate,
-            channels=self.channels,
-            sample_width=self.bytes_per_sample,
-        )  # type: AudioSegment
-
+    async def to_audio_source_async(self, executor: Executor | None = None):
+        """Encode the buffered audio in the given executor."""
         file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-
-        # segment = segment.set_frame_rate(48000)
-        segment.export(file, format="wav")
+        file.close()
+
+        await asyncio.get_running_loop().run_in_executor(
+            executor,
+            encode_pcm_to_wav,
+            self.buffer.getvalue(),
+            file.name,
+            self.sample_rate,
+            self.channels,
+            self.bytes_per_sample,
+        )
 
         return FFmpegPCMAudio(file.name)
 
 
-async def realtime_fact(voice_client: voice_recv.VoiceRecvClient):
-    client = AsyncOpenAI()
+async def realtime_fact(
+    voice_client: voice_recv.VoiceRecvClient,
+    executor: Executor | None = None,
+    client: "AsyncOpenAI | None" = None,
+):
+    client = client or get_async_client()
 
     async with client.beta.realtime.connect(
         model="gpt-4o-realtime-preview-2024-12-17"
@@ -85,7 +113,7 @@ async def realtime_fact(voice_client: voice_recv.VoiceRecvClient):
                 audio_buffer.write(audio)
 
             if event.type == "response.audio.done":
-                audio_source = audio_buffer.to_audio_source()
+                audio_source = await audio_buffer.to_audio_source_async(executor)
                 voice_client.play(audio_source)
                 while voice_client.is_playing():
                     await asyncio.sleep(2)
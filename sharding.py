@@ -0,0 +1,94 @@
+"""
+Module for running Meidobot with its gateway shards split across processes.
+"""
+
+import logging
+import multiprocessing
+import os
+from typing import TYPE_CHECKING, Callable, List
+
+if TYPE_CHECKING:
+    from meidobot import MeidobotClient
+
+logger = logging.getLogger("meidobot.sharding")
+
+# Creates a client for the given shard IDs and shard count
+ClientFactory = Callable[[List[int] | None, int | None], "MeidobotClient"]
+
+
+def shard_ids_for_process(
+    shard_count: int, process_count: int, process_index: int
+) -> List[int]:
+    """Get the shard IDs that a worker process should run.
+
+    Args:
+        shard_count (int): Total number of shards.
+        process_count (int): Number of worker processes.
+        process_index (int): Index of the worker process.
+
+    Returns:
+        List[int]: The shard IDs for the process.
+    """
+    return list(range(process_index, shard_count, process_count))
+
+
+def run_worker(
+    create_client: ClientFactory,
+    token: str,
+    shard_ids: List[int] | None,
+    shard_count: int | None,
+):
+    """Run a Meidobot client for the given shards in this process."""
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Starting worker %s for shards %s", os.getpid(), shard_ids)
+
+    client = create_client(shard_ids, shard_count)
+    client.run(token)
+
+
+def run_sharded(
+    create_client: ClientFactory,
+    token: str,
+    shard_count: int | None,
+    process_count: int,
+):
+    """Run Meidobot with the shards split across worker processes.
+
+    With a single process all shards are run by one `AutoShardedBot`.
+
+    Args:
+        create_client (ClientFactory): Function that creates the client for
+            the shards of a process. It is passed in instead of imported, so
+            that meidobot.py isn't loaded a second time when it is run as a
+            script.
+        token (str): Discord bot token.
+        shard_count (int | None): Total number of shards. If None, the
+            number recommended by Discord is used.
+        process_count (int): Number of worker processes.
+    """
+    if process_count <= 1:
+        run_worker(create_client, token, None, shard_count)
+        return
+
+    if shard_count is None:
+        raise ValueError("SHARD_COUNT must be set when running multiple processes")
+
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(
+                create_client,
+                token,
+                shard_ids_for_process(shard_count, process_count, i),
+                shard_count,
+            ),
+            name=f"meidobot-worker-{i}",
+        )
+        for i in range(min(process_count, shard_count))
+    ]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
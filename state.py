@@ -0,0 +1,87 @@
+"""
+Pluggable storage for state that Meidobot keeps between messages: the chat
+log, the rate limit buckets and the daily facts.
+
+Only a local, in-process backend is provided. A backend shared between
+worker processes can be added by implementing `StateBackend`. The message
+cache used for reply chains holds live Discord messages, so it stays local
+to each process.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Dict, Deque, Hashable, List, Tuple
+
+
+class StateBackend(ABC):
+    """
+    Interface for storing Meidobot state.
+
+    Stored values are plain data, such as named tuples of ints and strings,
+    so that backends shared between processes can serialize them.
+    """
+
+    @abstractmethod
+    def append(self, key: Hashable, value: Any, max_length: int) -> None:
+        """Append a value to the list stored under a key.
+
+        The oldest values are dropped when the list grows over `max_length`.
+        """
+
+    @abstractmethod
+    def get_list(self, key: Hashable) -> List[Any]:
+        """Get the list stored under a key, or an empty list."""
+
+    @abstractmethod
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a cached value, or `default` if it is missing or has expired."""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Set a cached value that expires after `ttl` seconds, if given."""
+
+
+class LocalStateBackend(StateBackend):
+    """State backend that keeps everything in the memory of this process."""
+
+    # Expired values are removed when there are more values than this
+    max_values = 10000
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lists = {}  # type: Dict[Hashable, Deque[Any]]
+        # Values with the time they expire at, or None
+        self._values = {}  # type: Dict[Hashable, Tuple[Any, float | None]]
+
+    def append(self, key: Hashable, value: Any, max_length: int) -> None:
+        if key not in self._lists:
+            self._lists[key] = deque(maxlen=max_length)
+
+        self._lists[key].append(value)
+
+    def get_list(self, key: Hashable) -> List[Any]:
+        return list(self._lists.get(key, ()))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._values:
+            return default
+
+        value, expires = self._values[key]
+        if expires is not None and expires <= self._clock():
+            del self._values[key]
+            return default
+
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        if len(self._values) >= self.max_values:
+            now = self._clock()
+            self._values = {
+                k: (v, expires)
+                for k, (v, expires) in self._values.items()
+                if expires is None or expires > now
+            }
+
+        expires = None if ttl is None else self._clock() + ttl
+        self._values[key] = (value, expires)
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiohttp
+import discord
+
+from chat import MeidobotChatClient, MessageCache
+
+
+def make_message(message_id: int, reference_id: int | None = None, author_id=5):
+    message = MagicMock(spec=discord.Message)
+    message.id = message_id
+    message.author.id = author_id
+    message.channel = MagicMock(id=1)
+    message.channel.fetch_message = AsyncMock()
+
+    if reference_id is None:
+        message.reference = None
+    else:
+        message.reference = MagicMock(
+            message_id=reference_id, channel_id=1, resolved=None, cached_message=None
+        )
+
+    return message
+
+
+def mock_history(channel, messages):
+    """Make `channel.history` return the given messages."""
+
+    async def history(**kwargs):
+        for message in messages:
+            yield message
+
+    channel.history = MagicMock(side_effect=history)
+
+
+class TestMessageCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cache = MessageCache()
+
+    async def test_reply_chain_is_resolved_from_cache(self):
+        """Test that cached replies are resolved without fetching."""
+        first = make_message(1)
+        second = make_message(2, reference_id=1)
+        third = make_message(3, reference_id=2)
+        self.cache.add(first)
+        self.cache.add(second)
+
+        chain = await self.cache.get_reply_chain(third, max_depth=3)
+
+        self.assertEqual(chain, [first, second])
+        third.channel.fetch_message.assert_not_awaited()
+
+    async def test_reply_chain_is_fetched_in_one_batch(self):
+        """Test that an uncached reply chain is fetched with one request."""
+        first = make_message(1)
+        second = make_message(2, reference_id=1)
+        third = make_message(3, reference_id=2)
+        mock_history(third.channel, [second, first])
+
+        chain = await self.cache.get_reply_chain(third, max_depth=3)
+
+        self.assertEqual(chain, [first, second])
+        third.channel.history.assert_called_once()
+
+    async def test_concurrent_fetches_are_shared(self):
+        """Test that an uncached message is fetched only once."""
+        fetched = make_message(1)
+        reply = make_message(2, reference_id=1)
+        mock_history(reply.channel, [fetched])
+
+        results = await asyncio.gather(
+            self.cache.resolve_reference(reply), self.cache.resolve_reference(reply)
+        )
+
+        self.assertEqual(results, [fetched, fetched])
+        reply.channel.history.assert_called_once()
+        self.assertIs(self.cache.get(1), fetched)
+
+    async def test_missing_message_is_not_fetched_again(self):
+        """Test that a deleted message is only fetched once."""
+        reply = make_message(2, reference_id=1)
+        mock_history(reply.channel, [])
+
+        self.assertIsNone(await self.cache.resolve_reference(reply))
+        self.assertIsNone(await self.cache.resolve_reference(reply))
+        reply.channel.history.assert_called_once()
+
+    async def test_network_errors_are_not_raised(self):
+        """Test that a failing fetch returns None and is retried later."""
+        reply = make_message(2, reference_id=1)
+        reply.channel.history = MagicMock(side_effect=aiohttp.ClientError())
+
+        self.assertIsNone(await self.cache.resolve_reference(reply))
+        self.assertIsNone(await self.cache.resolve_reference(reply))
+        self.assertEqual(reply.channel.history.call_count, 2)
+
+    async def test_forbidden_channel_is_not_fetched_again(self):
+        """Test that a channel without access to its history is skipped."""
+        response = MagicMock(status=403, reason="Forbidden")
+        first = make_message(2, reference_id=1)
+        first.channel.history = MagicMock(
+            side_effect=discord.Forbidden(response, "Missing Access")
+        )
+        second = make_message(4, reference_id=3)
+        second.channel = first.channel
+
+        self.assertIsNone(await self.cache.resolve_reference(first))
+        self.assertIsNone(await self.cache.resolve_reference(second))
+        first.channel.history.assert_called_once()
+
+
+class TestMeidobotChatClient(unittest.TestCase):
+    @patch.dict(os.environ, {"OPENAI_API_KEY": "test"})
+    def setUp(self):
+        self.client = MeidobotChatClient(None, discord_client_id=99)
+
+    def test_reply_to_bot_is_detected_without_fetching(self):
+        """Test that replies to the bot's messages are detected locally."""
+        bot_message = make_message(1, author_id=99)
+        self.client.save_message_to_log(bot_message)
+
+        reply_to_bot = make_message(2, reference_id=1)
+        reply_to_unknown = make_message(3, reference_id=50)
+
+        self.assertTrue(self.client.is_reply_to_bot(reply_to_bot))
+        self.assertFalse(self.client.is_reply_to_bot(reply_to_unknown))
+        reply_to_unknown.channel.history.assert_not_called()
@@ -0,0 +1,105 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+from zoneinfo import ZoneInfo
+
+from facts import DailyFactPrefetcher, seconds_until_next_midnight
+from state import LocalStateBackend
+
+
+class TestDailyFactPrefetcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.chat_client = MagicMock()
+        self.chat_client.daily_fun_fact = AsyncMock(
+            side_effect=lambda previous: f"fact {len(previous)}"
+        )
+        self.voice_client = MagicMock()
+        self.voice_client.speech_to_file = AsyncMock()
+        self.backend = LocalStateBackend()
+        self.directory = tempfile.mkdtemp()
+        self.prefetcher = self.make_prefetcher()
+
+    def make_prefetcher(self) -> DailyFactPrefetcher:
+        prefetcher = DailyFactPrefetcher(
+            self.chat_client,
+            self.voice_client,
+            state_backend=self.backend,
+            directory=self.directory,
+        )
+        prefetcher.pool_size = 2
+        return prefetcher
+
+    async def asyncTearDown(self):
+        await self.prefetcher.stop()
+        shutil.rmtree(self.directory)
+
+    async def test_facts_are_rotated(self):
+        """Test that prefetched facts are handed out in rotation."""
+        self.assertIsNone(self.prefetcher.get())
+        await self.prefetcher.refill()
+
+        first = self.prefetcher.get()
+        second = self.prefetcher.get()
+
+        self.assertEqual([first.text, second.text], ["fact 0", "fact 1"])
+        self.assertIsNotNone(first.audio_path)
+        self.assertEqual(self.voice_client.speech_to_file.await_count, 2)
+
+    async def test_pool_is_not_refilled_during_the_day(self):
+        """Test that the day's pool is rotated without generating new facts."""
+        await self.prefetcher.refill()
+        texts = [self.prefetcher.get().text for _ in range(5)]
+
+        self.assertEqual(texts, ["fact 0", "fact 1", "fact 0", "fact 1", "fact 0"])
+        await asyncio.sleep(0)
+        self.assertEqual(self.chat_client.daily_fun_fact.await_count, 2)
+
+    async def test_stored_facts_are_reused(self):
+        """Test that another prefetcher reuses the day's texts and audio."""
+        await self.prefetcher.refill()
+        first = self.prefetcher.get()
+
+        other = self.make_prefetcher()
+        self.assertTrue(await other.refill())
+
+        self.assertEqual(other.get(), first)
+        self.assertEqual(self.chat_client.daily_fun_fact.await_count, 2)
+        self.assertEqual(self.voice_client.speech_to_file.await_count, 2)
+
+    async def test_failed_refill_is_reported(self):
+        """Test that a failing completion doesn't leave a broken pool."""
+        self.chat_client.daily_fun_fact.side_effect = RuntimeError("API down")
+
+        self.assertFalse(await self.prefetcher.refill())
+        self.assertIsNone(self.prefetcher.get())
+
+    async def test_refills_are_capped_per_day(self):
+        """Test that failing refills are only retried a few times a day."""
+        self.chat_client.daily_fun_fact.side_effect = lambda previous: None
+
+        for _ in range(DailyFactPrefetcher.max_refills_per_day):
+            self.assertFalse(await self.prefetcher.refill())
+
+        self.assertIsNone(self.prefetcher.refill())
+        self.assertIsNone(self.prefetcher.get())
+        self.assertEqual(
+            self.chat_client.daily_fun_fact.await_count,
+            DailyFactPrefetcher.max_refills_per_day * 2,
+        )
+
+
+class TestSecondsUntilNextMidnight(unittest.TestCase):
+    def test_seconds_until_next_midnight(self):
+        """Test that changes to and from daylight saving time are counted."""
+        helsinki = ZoneInfo("Europe/Helsinki")
+
+        # Clocks are turned back an hour on the night of 27 October 2024
+        before_dst_end = datetime(2024, 10, 27, 0, 30, tzinfo=helsinki)
+        self.assertEqual(seconds_until_next_midnight(before_dst_end), 24.5 * 3600)
+
+        # Clocks are turned forward an hour on the night of 31 March 2024
+        before_dst_start = datetime(2024, 3, 31, 0, 30, tzinfo=helsinki)
+        self.assertEqual(seconds_until_next_midnight(before_dst_start), 22.5 * 3600)
@@ -1,7 +1,15 @@
+import os
+import subprocess
+import sys
 import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import discord
-from meidobot import MeidobotClient
+from chat import MeidobotChatClient
+from discord.ext import commands
+from facts import DailyFact
+from meidobot import MeidobotClient, MeidoCommands
+from ratelimit import AdmissionController
 
 
 class TestMeidoBot(unittest.TestCase):
@@ -21,3 +29,132 @@ class TestMeidoBot(unittest.TestCase):
                 self.meido._trigger_word_in_str(sentence),
                 result,
             )
+
+    def test_heavy_modules_imported_lazily(self):
+        """Test that importing the bot doesn't load voice or OpenAI modules."""
+        heavy_modules = [
+            "openai",
+            "pydub",
+            "realtime",
+            "voice",
+            "discord.ext.voice_recv",
+        ]
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, meidobot; "
+                f"print([m for m in {heavy_modules!r} if m in sys.modules])",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+class TestMeidoBotSetup(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.meido = MeidobotClient(
+            intents=discord.Intents.none(), prefetch_daily_facts=False
+        )
+        self.meido._connection.user = MagicMock(id=1)
+
+    async def asyncTearDown(self):
+        if self.meido._daily_facts is not None:
+            await self.meido._daily_facts.stop()
+
+        self.meido._media_executor.shutdown()
+
+    @patch.dict(os.environ, {"OPENAI_API_KEY": "test"})
+    async def test_daily_facts_are_not_prefetched_when_disabled(self):
+        """Test that the prefetcher is not started when prefetching is disabled."""
+        with patch("meidobot.DailyFactPrefetcher.start") as start:
+            await self.meido.setup_hook()
+
+        start.assert_not_called()
+        self.assertIsNotNone(self.meido._daily_facts)
+
+    @patch.dict(os.environ, {"OPENAI_API_KEY": "test"})
+    async def test_second_setup_fails(self):
+        """Test that setting up again raises instead of replacing the state."""
+        await self.meido.setup_hook()
+        client = self.meido._client
+
+        with self.assertRaises(discord.ClientException):
+            await self.meido.setup_hook()
+
+        self.assertIs(self.meido._client, client)
+        self.assertEqual(len(self.meido.cogs), 1)
+
+    async def test_messages_before_setup_are_ignored(self):
+        """Test that messages received before setup are not handled."""
+        for content in ["meidobot, hei!", "!fact"]:
+            message = MagicMock(spec=discord.Message, content=content)
+            message.author.bot = False
+            message.channel.send = AsyncMock()
+
+            with patch.object(self.meido, "process_commands") as process_commands:
+                await self.meido.on_message(message)
+
+            process_commands.assert_not_called()
+            message.channel.send.assert_not_awaited()
+
+
+class TestMeidoCommands(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.meido = MeidobotClient(intents=discord.Intents.none())
+        self.admission = AdmissionController()
+        self.cog = MeidoCommands(MagicMock(), MagicMock(), admission=self.admission)
+        await self.meido.add_cog(self.cog)
+
+        self.ctx = MagicMock()
+        self.ctx.bot = self.meido
+        self.ctx.message.author.id = 1
+        self.ctx.message.channel.id = 10
+        self.ctx.message.guild = None
+
+    async def asyncTearDown(self):
+        self.meido._media_executor.shutdown()
+
+    async def test_help_does_not_use_tokens(self):
+        """Test that checking the commands, as `!help` does, takes no tokens."""
+        for _ in range(3):
+            for command in self.cog.get_commands():
+                self.ctx.command = command
+                self.assertTrue(await command.can_run(self.ctx))
+
+        self.assertEqual(sum(self.admission.rejections.values()), 0)
+        self.assertTrue(self.admission.admit(self.ctx.message, "command"))
+        self.assertTrue(self.admission.admit(self.ctx.message, "command"))
+
+    async def test_invoking_commands_uses_tokens(self):
+        """Test that invoking commands is rate limited."""
+        await self.cog.cog_before_invoke(self.ctx)
+        await self.cog.cog_before_invoke(self.ctx)
+
+        with self.assertRaises(commands.CheckFailure):
+            await self.cog.cog_before_invoke(self.ctx)
+
+        self.assertEqual(self.admission.rejections[("command", "user")], 1)
+
+    @patch.dict(os.environ, {"OPENAI_API_KEY": "test"})
+    async def test_replies_to_command_answers_are_detected(self):
+        """Test that messages sent by commands are recognized as the bot's."""
+        chat_client = MeidobotChatClient(None, discord_client_id=99)
+        daily_facts = MagicMock()
+        daily_facts.get.return_value = DailyFact("Fact of the day", None)
+        cog = MeidoCommands(MagicMock(), chat_client, daily_facts=daily_facts)
+
+        answer = MagicMock(spec=discord.Message, id=5)
+        answer.author.id = 99
+        self.ctx.send = AsyncMock(return_value=answer)
+
+        await cog.fact.callback(cog, self.ctx)
+
+        reply = MagicMock(spec=discord.Message, id=6)
+        reply.channel = answer.channel
+        reply.reference = MagicMock(message_id=5, resolved=None, cached_message=None)
+        self.assertTrue(chat_client.is_reply_to_bot(reply))
@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+
+from ratelimit import AdmissionController, FairScheduler, TokenBucket
+from state import LocalStateBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_message(user_id: int, channel_id: int, guild_id: int | None):
+    message = MagicMock()
+    message.author.id = user_id
+    message.channel.id = channel_id
+    message.guild = None if guild_id is None else MagicMock(id=guild_id)
+    return message
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refills_over_time(self):
+        """Test that tokens are refilled up to the capacity."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1.0, capacity=2, clock=clock)
+
+        bucket.acquire(2)
+        self.assertFalse(bucket.can_acquire(1))
+
+        clock.now = 1.0
+        self.assertTrue(bucket.can_acquire(1))
+
+        clock.now = 10.0
+        self.assertEqual(bucket.tokens, 2)
+
+
+class TestAdmissionController(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.admission = AdmissionController(clock=self.clock)
+
+    def test_user_is_limited(self):
+        """Test that a spamming user is limited but others are not."""
+        spammer = make_message(1, 10, 100)
+        results = [self.admission.admit(spammer, "reply") for _ in range(10)]
+
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(self.admission.rejections[("reply", "user")], 5)
+        self.assertTrue(self.admission.admit(make_message(2, 10, 100), "reply"))
+
+    def test_reactions_are_rejected_before_replies(self):
+        """Test that reactions are skipped once the buckets run low."""
+        message = make_message(1, 10, None)
+
+        self.assertTrue(self.admission.admit(message, "reaction"))
+        self.assertTrue(self.admission.admit(message, "reaction"))
+        self.assertFalse(self.admission.admit(message, "reaction"))
+
+    def test_buckets_are_shared_through_backend(self):
+        """Test that controllers with the same backend share the buckets."""
+        backend = LocalStateBackend(clock=self.clock)
+        first = AdmissionController(state_backend=backend, clock=self.clock)
+        second = AdmissionController(state_backend=backend, clock=self.clock)
+        message = make_message(1, 10, 100)
+
+        results = [
+            admission.admit(message, "reply") for admission in [first, second] * 3
+        ]
+
+        self.assertEqual(results.count(True), 5)
+        self.assertTrue(self.admission.admit(message, "reply"))
+
+
+class TestFairScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_guilds_are_interleaved(self):
+        """Test that a busy guild doesn't starve a guild that arrives later."""
+        scheduler = FairScheduler(max_concurrent=1)
+        started = []
+        release = asyncio.Event()
+
+        async def job(name: str):
+            started.append(name)
+            await release.wait()
+
+        tasks = [asyncio.create_task(scheduler.run(1, job, f"a{i}")) for i in range(4)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.run(2, job, "b0")))
+        await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+        self.assertEqual(started, ["a0", "a1", "b0", "a2", "a3"])
+
+    async def test_finish_times_are_dropped(self):
+        """Test that keys are forgotten once their requests have been run."""
+        scheduler = FairScheduler(max_concurrent=1)
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        tasks = [asyncio.create_task(scheduler.run(key, job)) for key in range(5)]
+        await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+        self.assertEqual(scheduler._finish_times, {})
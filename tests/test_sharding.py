@@ -0,0 +1,11 @@
+import unittest
+
+from sharding import shard_ids_for_process
+
+
+class TestSharding(unittest.TestCase):
+    def test_shards_are_split_across_processes(self):
+        """Test that every shard is run by exactly one process."""
+        shards = [shard_ids_for_process(10, 3, i) for i in range(3)]
+
+        self.assertEqual(shards, [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]])
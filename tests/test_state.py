@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import MagicMock
+
+from chat import ChatLog, LoggedMessage
+from state import LocalStateBackend
+
+
+class TestLocalStateBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = LocalStateBackend()
+
+    def test_append_keeps_max_length(self):
+        """Test that only the newest values are kept in a list."""
+        for i in range(15):
+            self.backend.append("channel", i, 10)
+
+        self.assertEqual(self.backend.get_list("channel"), list(range(5, 15)))
+        self.assertEqual(self.backend.get_list("missing"), [])
+
+    def test_get_and_set(self):
+        """Test that cached values can be read back."""
+        self.backend.set("key", "value")
+
+        self.assertEqual(self.backend.get("key"), "value")
+        self.assertIsNone(self.backend.get("missing"))
+
+    def test_values_expire(self):
+        """Test that values are dropped after their time to live."""
+        now = [0.0]
+        backend = LocalStateBackend(clock=lambda: now[0])
+        backend.set("expiring", 1, ttl=10)
+        backend.set("kept", 2)
+
+        now[0] = 10.0
+
+        self.assertIsNone(backend.get("expiring"))
+        self.assertEqual(backend.get("kept"), 2)
+
+
+class TestChatLog(unittest.TestCase):
+    def test_messages_are_logged_as_records(self):
+        """Test that the chat log stores plain records instead of messages."""
+        backend = LocalStateBackend()
+        chat_log = ChatLog(backend)
+        channel = MagicMock(id=10)
+        message = MagicMock(id=1, content="Hei <@2>", mentions=[])
+        message.author.id = 3
+        message.author.display_name = "Antti"
+        message.author.bot = False
+
+        chat_log.log_message(channel, message)
+
+        self.assertEqual(
+            chat_log.get_log(channel),
+            [LoggedMessage(1, 3, "Antti", "Hei <@2>", False)],
+        )
@@ -3,8 +3,35 @@ Module for utility functions such as checking available models, etc.
 """
 
 import argparse
+import os
+import statistics
+import subprocess
+import sys
 import openai
 
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import meidobot
+print(time.perf_counter() - start)
+"""
+
+READY_SNIPPET = """
+import time
+start = time.perf_counter()
+import os
+from meidobot import create_client
+# Prefetching would generate completions and speech on every run
+client = create_client(prefetch_daily_facts=False)
+
+@client.listen()
+async def on_ready():
+    print(time.perf_counter() - start)
+    await client.close()
+
+client.run(os.environ["DISCORD_TOKEN"], log_handler=None)
+"""
+
 
 def print_available_models():
     """Print all available models."""
@@ -18,6 +45,41 @@ def print_available_models():
         print(model.id)
 
 
+def _time_snippet(snippet: str) -> float:
+    """Run a snippet in a fresh interpreter and return the time it prints."""
+    result = subprocess.run(
+        [sys.executable, "-c", snippet],
+        capture_output=True,
+        check=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark_startup(runs: int):
+    """Print how long importing Meidobot and becoming ready takes.
+
+    The time to ready is only measured when DISCORD_TOKEN is set, as it
+    connects to Discord.
+    """
+    import_times = [_time_snippet(IMPORT_SNIPPET) for _ in range(runs)]
+    print(
+        f"Import: median {statistics.median(import_times):.3f} s, "
+        f"min {min(import_times):.3f} s over {runs} runs"
+    )
+
+    if os.environ.get("DISCORD_TOKEN") is None:
+        print("DISCORD_TOKEN not set, skipping time to ready.")
+        return
+
+    ready_times = [_time_snippet(READY_SNIPPET) for _ in range(runs)]
+    print(
+        f"First ready: median {statistics.median(ready_times):.3f} s, "
+        f"min {min(ready_times):.3f} s over {runs} runs"
+    )
+
+
 def main():
     """Main function."""
     parser = argparse.ArgumentParser(
@@ -28,10 +90,23 @@ def main():
         action="store_true",
         help="List all available models.",
     )
+    parser.add_argument(
+        "--benchmark-startup",
+        action="store_true",
+        help="Measure import time and time to first ready.",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="Number of runs for benchmarks.",
+    )
     args = parser.parse_args()
 
     if args.list_models:
         print_available_models()
+    elif args.benchmark_startup:
+        benchmark_startup(args.runs)
     else:
         parser.print_help()
 
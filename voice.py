@@ -1,59 +1,97 @@
-from contextlib import contextmanager
-from openai import OpenAI
+import asyncio
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+import os
 from typing import Literal
 import tempfile
 
+from openai_clients import get_client
+
+
+def synthesize_speech(
+    api_key: str,
+    text: str,
+    path: str,
+    model: str,
+    voice: str,
+    response_format: str,
+    speed: float,
+):
+    """
+    Synthesize speech for the given text and write it to a file.
+
+    This is a module level function so that it can be run in a process pool.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        text (str): The text to be synthesized.
+        path (str): Path of the file the audio is written to.
+    """
+    stream = get_client(api_key).with_streaming_response.audio.speech.create(
+        model=model,
+        voice=voice,  # type: ignore
+        response_format=response_format,  # type: ignore
+        input=text,
+        speed=speed,
+    )
+
+    with stream as s, open(path, "wb") as f:
+        for chunk in s.iter_bytes(2048):
+            f.write(chunk)
+
 
 class VoiceClient:
     model = "tts-1"
     voice: Literal["alloy", "echo", "fable", "onyx", "nova", "shimmer"] = "nova"
     format: Literal["mp3", "opus", "aac", "flac", "wav", "pcm"] = "opus"
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, executor: Executor | None = None):
+        """
+        Initialize the VoiceClient.
+
+        Args:
+            api_key (str): The OpenAI API key.
+            executor (Executor | None): Executor that runs speech synthesis.
+                Defaults to the default executor of the event loop.
+        """
         self.api_key = api_key
-        self._client = OpenAI(api_key=api_key)
+        self._executor = executor
 
-    def stream_speech(self, text: str):
+    async def speech_to_file(self, text: str, path: str):
         """
-        Streams the given text as speech and yields the audio chunks.
+        Synthesize the given text to a file without blocking the event loop.
+        The synthesis runs in the executor of the client.
 
         Args:
-            text (str): The text to be streamed as speech.
-
-        Yields:
-            bytes: Audio chunks of the streamed speech.
+            text (str): The text to be synthesized.
+            path (str): Path of the file the audio is written to.
         """
-        stream = self._client.with_streaming_response.audio.speech.create(
-            model=self.model,
-            voice=self.voice,
-            response_format=self.format,
-            input=text,
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            synthesize_speech,
+            self.api_key,
+            text,
+            path,
+            self.model,
+            self.voice,
+            self.format,
+            0.95,
         )
 
-        with stream as s:
-            for chunk in s.iter_bytes(2048):
-                yield chunk
+    @asynccontextmanager
+    async def speech_file_async(self, text: str):
+        """
+        Synthesize the given text to a temporary file.
+
+        Yields:
+            str: Path to the audio file. The file is removed on exit.
+        """
+        file = tempfile.NamedTemporaryFile(suffix=".ogg", delete=False)
+        file.close()
 
-    @contextmanager
-    def speech_file(self, text: str):
         try:
-            file = tempfile.NamedTemporaryFile(suffix=".ogg", delete=False)
-
-            with file as f:
-                stream = self._client.with_streaming_response.audio.speech.create(
-                    model=self.model,
-                    voice=self.voice,
-                    response_format=self.format,
-                    input=text,
-                    speed=0.95,
-                )
-
-                with stream as s:
-                    for chunk in s.iter_bytes(2048):
-                        f.write(chunk)
-                    file.seek(0)
-
-            yield f.name
+            await self.speech_to_file(text, file.name)
+
+            yield file.name
         finally:
-            file.delete = True
-            file.close()
+            os.remove(file.name)